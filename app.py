@@ -7,7 +7,8 @@ lightweight databases and an AI chat assistant – without re‑implementing
 Notion’s entire feature set. Users can create pages, nest them hierarchically,
 edit the contents of each page, create basic checklists and simple tables,
 search through their workspace and chat with a placeholder AI.  Data is
-persisted to a JSON file on disk so that sessions survive server restarts.
+persisted to a SQLite database on disk so that sessions survive server
+restarts.
 
 This app uses only libraries that are available in this environment.  It runs
 as a web service on localhost using FastAPI and Jinja2 for templating.  To try
@@ -17,68 +18,319 @@ directory and navigate to http://127.0.0.1:8000/ in your browser.
 
 from __future__ import annotations
 
-import json
+import hashlib
+import logging
 import os
 import re
+import secrets
+import sqlite3
+import urllib.parse
 import uuid
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
+import httpx
+import orjson
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from markupsafe import Markup, escape
 import os
-import requests
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 
 
 BASE_DIR = Path(__file__).resolve().parent
+DB_FILE = BASE_DIR / "pages.db"
 DATA_FILE = BASE_DIR / "pages.json"
 SETTINGS_FILE = BASE_DIR / "settings.json"
+STATIC_DIR = BASE_DIR / "static"
 
 app = FastAPI(title="Notion‑style Workspace")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+
+class CachedStaticFiles(StaticFiles):
+    """Static files that browsers may cache indefinitely when requested with
+    the current asset version (`?v=<STATIC_VERSION>`).  Any other request,
+    including one carrying an outdated version, keeps Starlette’s default
+    revalidation headers so old URLs never pin new content."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        query = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if query.get("v") == [STATIC_VERSION]:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+def static_version() -> str:
+    """Return a short fingerprint of the static assets.  Templates append it
+    to asset URLs, so a changed file gets a new URL after a restart and the
+    long‑lived cached copy is never served stale."""
+    digest = hashlib.sha1()
+    for path in sorted(STATIC_DIR.rglob("*")):
+        if path.is_file():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+STATIC_VERSION = static_version()
+app.mount("/static", CachedStaticFiles(directory=str(STATIC_DIR)), name="static")
+templates.env.globals["static_version"] = STATIC_VERSION
+
+# Line markup recognised by `render_content`: a code fence (optionally
+# indented) or a checklist item.  A single alternation means each rendered line
+# costs one regex match instead of a separate test per construct.
+_LINE_RE = re.compile(r"\s*(?P<fence>```)|- \[(?P<check>[ xX])\] (?P<task>.*)")
 
 
 #############################
 # Data management utilities #
 #############################
 
+# Pages live in a SQLite database.  Each page row records its parent and its
+# position among its siblings; database (table) rows hang off their page in a
+# separate table and are stored as JSON objects.  WAL journaling lets readers
+# proceed while a write is in progress, and every mutation touches only the
+# rows it changes instead of rewriting the whole workspace.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    pk        INTEGER PRIMARY KEY,
+    id        TEXT UNIQUE NOT NULL,
+    title     TEXT NOT NULL,
+    content   TEXT NOT NULL DEFAULT '',
+    parent_id TEXT REFERENCES pages(id) ON DELETE CASCADE,
+    position  INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_parent ON pages(parent_id, position);
+CREATE TABLE IF NOT EXISTS database_rows (
+    id      INTEGER PRIMARY KEY,
+    page_id TEXT NOT NULL REFERENCES pages(id) ON DELETE CASCADE,
+    data    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rows_page ON database_rows(page_id);
+
+-- Full‑text index over page titles and content.  The trigram tokenizer makes
+-- MATCH behave like a case‑insensitive substring search, and the triggers
+-- below keep it in step with the pages table.  It is keyed on the explicit
+-- `pk` column because the implicit rowid of a table may change on VACUUM.
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    title, content, content='pages', content_rowid='pk', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
+    INSERT INTO pages_fts(rowid, title, content)
+    VALUES (new.pk, new.title, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_ad AFTER DELETE ON pages BEGIN
+    INSERT INTO pages_fts(pages_fts, rowid, title, content)
+    VALUES ('delete', old.pk, old.title, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_au AFTER UPDATE OF title, content ON pages BEGIN
+    INSERT INTO pages_fts(pages_fts, rowid, title, content)
+    VALUES ('delete', old.pk, old.title, old.content);
+    INSERT INTO pages_fts(rowid, title, content)
+    VALUES (new.pk, new.title, new.content);
+END;
+"""
+SCHEMA_VERSION = 3
+
+# Every page in the subtree rooted at the bound page ID.
+_SUBTREE_SQL = """
+WITH RECURSIVE subtree(id) AS (
+    SELECT id FROM pages WHERE id = ?
+    UNION ALL
+    SELECT pages.id FROM pages JOIN subtree ON pages.parent_id = subtree.id
+)
+SELECT id FROM subtree
+"""
+
+
+def connect_db() -> sqlite3.Connection:
+    """Open the workspace database and make sure the schema exists."""
+    conn = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # SQLite's built-in lower() only folds ASCII; match Python's str.lower().
+    conn.create_function("py_lower", 1, str.lower, deterministic=True)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _upgrade_pages_table(conn)
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _upgrade_pages_table(conn: sqlite3.Connection) -> None:
+    """Rebuild a `pages` table created before it had an integer primary key.
+    The old full‑text index and its triggers are dropped; `SCHEMA` recreates
+    them and `init_db` repopulates the index.  Must run with foreign keys off
+    so dropping the old table does not cascade."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(pages)")}
+    if not columns or "pk" in columns:
+        return
+    conn.execute("BEGIN")
+    try:
+        for trigger in ("pages_ai", "pages_ad", "pages_au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS pages_fts")
+        conn.execute(
+            "CREATE TABLE pages_new ("
+            " pk INTEGER PRIMARY KEY,"
+            " id TEXT UNIQUE NOT NULL,"
+            " title TEXT NOT NULL,"
+            " content TEXT NOT NULL DEFAULT '',"
+            " parent_id TEXT REFERENCES pages(id) ON DELETE CASCADE,"
+            " position INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "INSERT INTO pages_new (id, title, content, parent_id, position) "
+            "SELECT id, title, content, parent_id, position FROM pages ORDER BY rowid"
+        )
+        conn.execute("DROP TABLE pages")
+        conn.execute("ALTER TABLE pages_new RENAME TO pages")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Run the enclosed statements atomically."""
+    DB.execute("BEGIN")
+    try:
+        yield DB
+    except BaseException:
+        DB.execute("ROLLBACK")
+        raise
+    DB.execute("COMMIT")
+
+
 def load_data() -> Dict[str, dict]:
-    """Load pages data from disk.  If the file does not exist the app starts with
-    a single root page titled "Home".  Data is stored as a dictionary keyed by
-    page ID.  Each page entry contains the title, raw content, children IDs,
-    and an optional database (list of dictionaries)."""
+    """Load pages from the legacy JSON file.  Older versions of the app kept
+    the whole workspace in `pages.json` as a dictionary keyed by page ID, each
+    entry holding the title, raw content, children IDs and an optional
+    database (list of dictionaries).  Returns an empty dictionary when the
+    file is missing or corrupted."""
     if DATA_FILE.exists():
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            # If the file is corrupted start fresh.
+            with open(DATA_FILE, "rb") as f:
+                return orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             pass
-    # Initialize with a single root page if no data is present.
-    root_id = str(uuid.uuid4())
-    data = {
-        root_id: {
+    return {}
+
+
+def init_db() -> None:
+    """Populate a newly created database.  Pages from a legacy `pages.json`
+    are imported; without one the app starts with a single root page titled
+    "Home".  The schema version pragma records that this has happened, and the
+    imported file is renamed to `pages.json.migrated`, so the import runs only
+    once.  Databases from an older schema version have their search index
+    rebuilt from the stored pages."""
+    version = DB.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    if version >= 1:
+        with transaction():
+            DB.execute("INSERT INTO pages_fts(pages_fts) VALUES ('rebuild')")
+            DB.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return
+    legacy = load_data()
+    data = legacy or {
+        str(uuid.uuid4()): {
             "title": "Home",
             "content": "Welcome to your Notion‑style workspace!",
             "children": [],
             "database": [],
         }
     }
-    save_data(data)
-    return data
+    parent_of = {cid: pid for pid, p in data.items() for cid in p.get("children", [])}
+    positions: Dict[Optional[str], int] = {}
+    with transaction():
+        # Walk each tree from its root so parents are inserted before their
+        # children and sibling positions follow the original order.
+        stack = [pid for pid in reversed(list(data)) if pid not in parent_of]
+        while stack:
+            pid = stack.pop()
+            pdata = data[pid]
+            parent_id = parent_of.get(pid)
+            position = positions.get(parent_id, 0)
+            positions[parent_id] = position + 1
+            DB.execute(
+                "INSERT INTO pages (id, title, content, parent_id, position) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (pid, pdata.get("title", "Untitled"), pdata.get("content", ""),
+                 parent_id, position),
+            )
+            DB.executemany(
+                "INSERT INTO database_rows (page_id, data) VALUES (?, ?)",
+                [(pid, orjson.dumps(row).decode()) for row in pdata.get("database", [])],
+            )
+            stack.extend(cid for cid in reversed(pdata.get("children", [])) if cid in data)
+        DB.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if legacy:
+        DATA_FILE.replace(DATA_FILE.with_suffix(".json.migrated"))
+
+
+def get_page(page_id: str) -> Optional[dict]:
+    """Return a page as a dictionary with its title and content, or None if no
+    such page exists.  Database rows are loaded separately with
+    `get_database_rows` by the views that show them."""
+    row = DB.execute(
+        "SELECT title, content FROM pages WHERE id = ?", (page_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "title": row["title"],
+        "content": row["content"],
+    }
+
+
+def page_exists(page_id: str) -> bool:
+    """Return True if a page with the given ID exists."""
+    return DB.execute("SELECT 1 FROM pages WHERE id = ?", (page_id,)).fetchone() is not None
+
+
+def get_database_rows(page_id: str) -> List[Dict[str, str]]:
+    """Return the rows of a page’s database in insertion order."""
+    rows = DB.execute(
+        "SELECT data FROM database_rows WHERE page_id = ? ORDER BY id", (page_id,)
+    )
+    return [orjson.loads(r["data"]) for r in rows]
+
+
+def add_database_row(page_id: str, row: Dict[str, str]) -> None:
+    """Append a row to a page’s database."""
+    DB.execute(
+        "INSERT INTO database_rows (page_id, data) VALUES (?, ?)",
+        (page_id, orjson.dumps(row).decode()),
+    )
+
 
+# Rendered HTML for each page keyed by page ID.  Each entry stores the hash of
+# the content it was rendered from so stale entries are never served; entries
+# are also dropped eagerly when a page is edited or deleted.
+_RENDER_CACHE: Dict[str, Tuple[int, Markup]] = {}
 
-def save_data(data: Dict[str, dict]) -> None:
-    """Persist the pages dictionary to disk in JSON format."""
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# Sidebar tree as returned by `get_page_tree`.  Rebuilt lazily after any
+# mutation that changes titles or the page hierarchy.
+_TREE_CACHE: Optional[List[dict]] = None
 
+# The sidebar rendered to HTML from `_TREE_CACHE`, so page views reuse the
+# markup instead of walking the recursive tree template on every request.
+_SIDEBAR_HTML: Optional[Markup] = None
 
-DATA = load_data()
+
+def invalidate_page_tree() -> None:
+    """Discard the cached sidebar tree and its rendered HTML so the next
+    request rebuilds them."""
+    global _TREE_CACHE, _SIDEBAR_HTML
+    _TREE_CACHE = None
+    _SIDEBAR_HTML = None
 
 
 def add_page(title: str, parent_id: Optional[str] = None) -> str:
@@ -86,121 +338,185 @@ def add_page(title: str, parent_id: Optional[str] = None) -> str:
     new page is appended to the parent’s children list.  Returns the new
     page’s ID."""
     page_id = str(uuid.uuid4())
-    DATA[page_id] = {
-        "title": title.strip() or "Untitled",
-        "content": "",
-        "children": [],
-        "database": [],
-    }
-    if parent_id and parent_id in DATA:
-        DATA[parent_id]["children"].append(page_id)
-    save_data(DATA)
+    if parent_id and not page_exists(parent_id):
+        parent_id = None
+    with transaction():
+        position = DB.execute(
+            "SELECT COALESCE(MAX(position) + 1, 0) FROM pages WHERE parent_id IS ?",
+            (parent_id,),
+        ).fetchone()[0]
+        DB.execute(
+            "INSERT INTO pages (id, title, parent_id, position) VALUES (?, ?, ?, ?)",
+            (page_id, title.strip() or "Untitled", parent_id, position),
+        )
+    invalidate_page_tree()
     return page_id
 
 
 def update_page(page_id: str, title: str, content: str) -> None:
     """Update the title and content of a page."""
-    if page_id in DATA:
-        DATA[page_id]["title"] = title.strip() or "Untitled"
-        DATA[page_id]["content"] = content
-        save_data(DATA)
+    cur = DB.execute(
+        "UPDATE pages SET title = ?, content = ? WHERE id = ?",
+        (title.strip() or "Untitled", content, page_id),
+    )
+    if cur.rowcount:
+        _RENDER_CACHE.pop(page_id, None)
+        invalidate_page_tree()
 
 
 def delete_page(page_id: str) -> None:
-    """Delete a page and all of its children recursively."""
-    if page_id not in DATA:
+    """Delete a page and all of its descendants."""
+    with transaction():
+        doomed = [r["id"] for r in DB.execute(_SUBTREE_SQL, (page_id,))]
+        DB.executemany("DELETE FROM pages WHERE id = ?", [(pid,) for pid in doomed])
+    if not doomed:
         return
-    # Recursively delete children first
-    for child_id in list(DATA[page_id]["children"]):
-        delete_page(child_id)
-    # Remove from parent’s children list
-    for pid, pdata in DATA.items():
-        if page_id in pdata.get("children", []):
-            pdata["children"].remove(page_id)
-    # Delete the page
-    DATA.pop(page_id, None)
-    save_data(DATA)
+    for pid in doomed:
+        _RENDER_CACHE.pop(pid, None)
+    invalidate_page_tree()
 
 
 def get_page_tree() -> List[dict]:
     """Return a list representing the top‑level pages.  Each entry contains
     page_id, title and its children recursively.  This is used to render the
-    sidebar."""
-    def build_node(pid: str) -> dict:
-        node = {"id": pid, "title": DATA[pid]["title"], "children": []}
-        for cid in DATA[pid]["children"]:
-            node["children"].append(build_node(cid))
-        return node
-
-    # Roots are pages that aren’t children of any other page.
-    all_children = {cid for p in DATA.values() for cid in p.get("children", [])}
-    root_ids = [pid for pid in DATA if pid not in all_children]
-    return [build_node(pid) for pid in root_ids]
+    sidebar.  The result is cached until the next mutation."""
+    global _TREE_CACHE
+    if _TREE_CACHE is not None:
+        return _TREE_CACHE
+
+    # One query fetches every page in sibling order; nodes are then linked to
+    # their parents in a single pass.
+    rows = DB.execute("SELECT id, title, parent_id FROM pages ORDER BY position").fetchall()
+    nodes = {r["id"]: {"id": r["id"], "title": r["title"], "children": []} for r in rows}
+    tree: List[dict] = []
+    for r in rows:
+        parent = nodes.get(r["parent_id"])
+        (parent["children"] if parent else tree).append(nodes[r["id"]])
+    _TREE_CACHE = tree
+    return _TREE_CACHE
+
+
+def sidebar_html() -> Markup:
+    """Return the rendered sidebar page tree, rendering it only after the
+    tree has changed."""
+    global _SIDEBAR_HTML
+    if _SIDEBAR_HTML is None:
+        template = templates.get_template("partials/sidebar.html")
+        _SIDEBAR_HTML = Markup(template.render(page_tree=get_page_tree()))
+    return _SIDEBAR_HTML
 
 
 def search_pages(query: str) -> List[dict]:
     """Return a list of pages whose title or content contains the query string
-    (case‑insensitive)."""
-    results = []
+    (case‑insensitive), ordered by title.
+
+    Queries of three or more characters are answered from the trigram
+    full‑text index; shorter ones cannot form a trigram and fall back to
+    scanning the pages table."""
     q = query.lower()
-    for pid, pdata in DATA.items():
-        if q in pdata["title"].lower() or q in pdata["content"].lower():
-            results.append({"id": pid, "title": pdata["title"]})
-    return results
+    if len(q) >= 3:
+        phrase = '"' + q.replace('"', '""') + '"'
+        rows = DB.execute(
+            "SELECT pages.id, pages.title FROM pages_fts "
+            "JOIN pages ON pages.pk = pages_fts.rowid "
+            "WHERE pages_fts MATCH ? ORDER BY py_lower(pages.title)",
+            (phrase,),
+        )
+    else:
+        rows = DB.execute(
+            "SELECT id, title FROM pages "
+            "WHERE instr(py_lower(title), ?) OR instr(py_lower(content), ?) "
+            "ORDER BY py_lower(title)",
+            (q, q),
+        )
+    return [{"id": r["id"], "title": r["title"]} for r in rows]
+
+
+DB = connect_db()
+init_db()
+
+
+@app.on_event("shutdown")
+async def close_db() -> None:
+    DB.close()
 
 
 #################################
 # Utility functions for display #
 #################################
 
-def render_content(raw: str) -> str:
+def render_content(raw: str) -> Markup:
     """Render raw page content into simple HTML.  This function implements
     minimal markup: newlines become paragraphs, markdown‑like checklist syntax
     becomes checkboxes, and code blocks fenced with triple backticks are
     displayed monospaced.  For simplicity, other markdown features are ignored.
+
+    User text is escaped with MarkupSafe’s C‑accelerated `escape` and the
+    result is returned as `Markup`, so templates render it without escaping
+    it a second time.
     """
     html_parts: List[str] = []
+    # Local aliases keep attribute and global lookups out of the loop.
+    append = html_parts.append
+    esc = escape
+    match = _LINE_RE.match
+    lines = raw.split("\n")
     in_code = False
-    for line in raw.split("\n"):
+    for line in lines:
+        m = match(line)
         # Toggle code block
-        if line.strip().startswith("```"):
+        if m and m["fence"]:
             in_code = not in_code
             if in_code:
-                html_parts.append("<pre><code>")
+                append("<pre><code>")
             else:
-                html_parts.append("</code></pre>")
+                append("</code></pre>")
             continue
         if in_code:
-            html_parts.append(html_escape(line) + "\n")
+            append(esc(line) + "\n")
             continue
         # Checklists
-        unchecked = re.match(r"^- \[ \] (.*)", line)
-        checked = re.match(r"^- \[x\] (.*)", line, re.IGNORECASE)
-        if unchecked:
-            task = unchecked.group(1)
-            html_parts.append(
-                f'<label><input type="checkbox" disabled> {html_escape(task)}</label><br>'
-            )
-        elif checked:
-            task = checked.group(1)
-            html_parts.append(
-                f'<label><input type="checkbox" checked disabled> {html_escape(task)}</label><br>'
+        if m:
+            checked = " checked" if m["check"] != " " else ""
+            append(
+                f'<label><input type="checkbox"{checked} disabled> {esc(m["task"])}</label><br>'
             )
         else:
             # Simple paragraph with line breaks
-            html_parts.append(f"<p>{html_escape(line)}</p>")
-    return "\n".join(html_parts)
-
-
-def html_escape(text: str) -> str:
-    """Escape HTML special characters for safe rendering."""
-    return (
-        text.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&#39;")
-    )
+            append(f"<p>{esc(line)}</p>")
+    return Markup("\n".join(html_parts))
+
+
+async def get_form(request: Request) -> Dict[str, str]:
+    """Return the request’s URL‑encoded form body as a flat dictionary.
+
+    `python-multipart` is not available in this environment, so Starlette’s
+    `request.form()` cannot be used.  `parse_qsl` yields one value per key,
+    avoiding the single‑item lists produced by `parse_qs`; blank values are
+    kept so handlers see every submitted field.  The parsed form is stored on
+    `request.state`, so any later caller in the same request reuses it.
+    """
+    form = getattr(request.state, "form", None)
+    if form is None:
+        body = await request.body()
+        form = dict(urllib.parse.parse_qsl(body.decode(), keep_blank_values=True))
+        request.state.form = form
+    return form
+
+
+async def common_context(request: Request) -> dict:
+    """Template context shared by every page: the request, the logged‑in
+    user, the pre‑rendered sidebar and the UI theme.  Handlers receive it through
+    `Depends`, so it is computed once per request and extended with
+    page‑specific keys.  It is declared `async` so it runs on the event loop
+    alongside the mutation helpers rather than in a worker thread, which keeps
+    reads of the database and the sidebar caches from racing with writes."""
+    return {
+        "request": request,
+        "user": get_current_user(request),
+        "sidebar_html": sidebar_html(),
+        "theme": SELECTED_THEME,
+    }
 
 
 ###################
@@ -208,56 +524,38 @@ def html_escape(text: str) -> str:
 ###################
 
 @app.get("/")
-async def home(request: Request):
+async def home(request: Request, ctx: dict = Depends(common_context)):
     """Render the home page, displaying the page tree and a welcome message."""
-    page_tree = get_page_tree()
-    user = get_current_user(request)
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "page_tree": page_tree,
-            "user": user,
-            "theme": SELECTED_THEME,
-        },
-    )
+    return templates.TemplateResponse("index.html", ctx)
 
 
 @app.get("/search")
-async def search(request: Request, q: str = ""):
+async def search(request: Request, q: str = "", ctx: dict = Depends(common_context)):
     """Search for pages containing the query string."""
     results = search_pages(q) if q else []
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "search.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "query": q,
             "results": results,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.get("/page/new")
-async def new_page_form(request: Request, parent: Optional[str] = None):
+async def new_page_form(
+    request: Request, parent: Optional[str] = None, ctx: dict = Depends(common_context)
+):
     """Display a form for creating a new page (login required)."""
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, ctx["user"])):
         return resp
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "new_page.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "parent": parent,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
@@ -266,80 +564,71 @@ async def new_page_form(request: Request, parent: Optional[str] = None):
 async def create_page(request: Request):
     """Handle form submission for creating a page.
 
-    Because `python-multipart` is not available in this environment, we parse
-    URL‑encoded form bodies manually using `urllib.parse.parse_qs`.  The
-    expected fields are `title` and an optional `parent`.
+    The expected fields are `title` and an optional `parent`.
     """
-    import urllib.parse
-
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    title = form.get("title", ["Untitled"])[0]
-    parent = form.get("parent", [None])[0]
+    form = await get_form(request)
+    title = form.get("title", "Untitled")
+    parent = form.get("parent") or None
     new_id = add_page(title, parent)
     return RedirectResponse(url=f"/page/{new_id}", status_code=302)
 
 
 @app.get("/page/{page_id}")
-async def view_page(request: Request, page_id: str):
-    if page_id not in DATA:
+async def view_page(request: Request, page_id: str, ctx: dict = Depends(common_context)):
+    page = get_page(page_id)
+    if page is None:
         return RedirectResponse(url="/", status_code=302)
-    page = DATA[page_id]
-    rendered = render_content(page.get("content", ""))
-    page_tree = get_page_tree()
-    user = get_current_user(request)
+    # Rows for the database preview below the page content
+    page["database"] = get_database_rows(page_id)
+    content = page.get("content", "")
+    content_hash = hash(content)
+    cached = _RENDER_CACHE.get(page_id)
+    if cached is not None and cached[0] == content_hash:
+        rendered = cached[1]
+    else:
+        rendered = render_content(content)
+        _RENDER_CACHE[page_id] = (content_hash, rendered)
     return templates.TemplateResponse(
         "page.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "page_id": page_id,
             "page": page,
             "rendered": rendered,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.get("/page/{page_id}/edit")
-async def edit_page_form(request: Request, page_id: str):
+async def edit_page_form(request: Request, page_id: str, ctx: dict = Depends(common_context)):
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, ctx["user"])):
         return resp
-    if page_id not in DATA:
+    page = get_page(page_id)
+    if page is None:
         return RedirectResponse(url="/", status_code=302)
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "edit_page.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "page_id": page_id,
-            "page": DATA[page_id],
-            "user": user,
-            "theme": SELECTED_THEME,
+            "page": page,
         },
     )
 
 
 @app.post("/page/{page_id}/edit")
 async def edit_page(request: Request, page_id: str):
-    """Update the title and content of a page (login required).  Form data is
-    parsed manually because python‑multipart is unavailable."""
+    """Update the title and content of a page (login required)."""
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
-    import urllib.parse
-
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    title = form.get("title", ["Untitled"])[0]
-    content = form.get("content", [""])[0]
+    form = await get_form(request)
+    title = form.get("title", "Untitled")
+    content = form.get("content", "")
     update_page(page_id, title, content)
     return RedirectResponse(url=f"/page/{page_id}", status_code=302)
 
@@ -347,7 +636,7 @@ async def edit_page(request: Request, page_id: str):
 @app.get("/page/{page_id}/delete")
 async def delete_page_route(request: Request, page_id: str):
     """Delete a page and its children (login required)."""
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
     delete_page(page_id)
     return RedirectResponse(url="/", status_code=302)
@@ -359,23 +648,18 @@ async def delete_page_route(request: Request, page_id: str):
 
 
 @app.get("/settings")
-async def settings_page(request: Request):
+async def settings_page(request: Request, ctx: dict = Depends(common_context)):
     """Display the settings page where users can choose a default AI model (login required)."""
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, ctx["user"])):
         return resp
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     available_models = ["Gemini", "GPT-4", "Claude", "Other"]
     return templates.TemplateResponse(
         "settings.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "selected_model": SELECTED_MODEL,
             "available_models": available_models,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
@@ -385,12 +669,10 @@ async def update_settings(request: Request):
     """Update settings based on form submission (login required).  Only the
     default AI model is currently configurable."""
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
-    import urllib.parse
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    model = form.get("model", [None])[0]
+    form = await get_form(request)
+    model = form.get("model")
     global SELECTED_MODEL, SETTINGS
     if model:
         SELECTED_MODEL = model
@@ -404,26 +686,21 @@ async def update_settings(request: Request):
 #######################################
 
 @app.get("/page/{page_id}/database")
-async def view_database(request: Request, page_id: str):
+async def view_database(request: Request, page_id: str, ctx: dict = Depends(common_context)):
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, ctx["user"])):
         return resp
-    if page_id not in DATA:
+    page = get_page(page_id)
+    if page is None:
         return RedirectResponse(url="/", status_code=302)
-    page = DATA[page_id]
-    database = page.get("database", [])
-    page_tree = get_page_tree()
-    user = get_current_user(request)
+    database = get_database_rows(page_id)
     return templates.TemplateResponse(
         "database.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "page_id": page_id,
             "page": page,
             "database": database,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
@@ -432,33 +709,29 @@ async def view_database(request: Request, page_id: str):
 async def add_db_row(request: Request, page_id: str):
     """Add a row to the page’s database.
 
-    Without python‑multipart we parse form data manually.  The form may
-    include existing column names as keys and values, plus `new_col` and
-    `new_val` for defining a new column.  Empty values are ignored.
+    The form may include existing column names as keys and values, plus
+    `new_col` and `new_val` for defining a new column.  Empty values are
+    ignored.
     """
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
-    import urllib.parse
-
-    if page_id not in DATA:
+    if not page_exists(page_id):
         return RedirectResponse(url="/", status_code=302)
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    new_col = form.get("new_col", [""])[0].strip()
-    new_val = form.get("new_val", [""])[0].strip()
+    form = await get_form(request)
+    new_col = form.get("new_col", "").strip()
+    new_val = form.get("new_val", "").strip()
     # Build row from existing fields; ignore blank values and the special fields.
     row: Dict[str, str] = {}
-    for key, values in form.items():
+    for key, value in form.items():
         if key in ("new_col", "new_val"):
             continue
-        value = values[0].strip()
+        value = value.strip()
         if value:
             row[key] = value
     if new_col:
         row[new_col] = new_val
-    DATA[page_id].setdefault("database", []).append(row)
-    save_data(DATA)
+    add_database_row(page_id, row)
     return RedirectResponse(url=f"/page/{page_id}/database", status_code=302)
 
 
@@ -468,33 +741,24 @@ async def add_db_row(request: Request, page_id: str):
 
 
 @app.get("/signup")
-async def signup_form(request: Request):
+async def signup_form(request: Request, ctx: dict = Depends(common_context)):
     """Render the sign‑up page."""
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "signup.html",
         {
-            "request": request,
-            "page_tree": page_tree,
-            "user": user,
+            **ctx,
             "error": None,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.post("/signup")
-async def signup_submit(request: Request):
+async def signup_submit(request: Request, ctx: dict = Depends(common_context)):
     """Process sign‑up form submission.  Creates a new user via Supabase."""
-    import urllib.parse
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    email = form.get("email", [""])[0]
-    password = form.get("password", [""])[0]
-    confirm = form.get("confirm", [""])[0]
-    page_tree = get_page_tree()
-    user = get_current_user(request)
+    form = await get_form(request)
+    email = form.get("email", "")
+    password = form.get("password", "")
+    confirm = form.get("confirm", "")
     error: Optional[str] = None
     # Simple validation
     if not email or not password:
@@ -502,7 +766,7 @@ async def signup_submit(request: Request):
     elif password != confirm:
         error = "Passwords do not match."
     if error is None:
-        success, err = supabase_signup(email, password)
+        success, err = await supabase_signup(email, password)
         if success:
             # Redirect to login with a success query param
             return RedirectResponse(url="/login?signup=success", status_code=302)
@@ -511,85 +775,69 @@ async def signup_submit(request: Request):
     return templates.TemplateResponse(
         "signup.html",
         {
-            "request": request,
-            "page_tree": page_tree,
-            "user": user,
+            **ctx,
             "error": error,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.get("/login")
-async def login_form(request: Request, signup: Optional[str] = None, next: str = "/"):
+async def login_form(
+    request: Request,
+    signup: Optional[str] = None,
+    next: str = "/",
+    ctx: dict = Depends(common_context),
+):
     """Render the login page.  If `signup=success` is present, display a
     congratulatory message."""
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     message = None
     if signup == "success":
         message = "Account created successfully. Please log in."
     return templates.TemplateResponse(
         "login.html",
         {
-            "request": request,
-            "page_tree": page_tree,
-            "user": user,
+            **ctx,
             "message": message,
             "error": None,
             "next": next,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.post("/login")
-async def login_submit(request: Request):
+async def login_submit(request: Request, ctx: dict = Depends(common_context)):
     """Process login form submission.  Authenticates against Supabase and
     creates a session."""
-    import urllib.parse
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    email = form.get("email", [""])[0]
-    password = form.get("password", [""])[0]
-    next_path = form.get("next", ["/"])[0] or "/"
-    page_tree = get_page_tree()
-    success, data, err = supabase_login(email, password)
+    form = await get_form(request)
+    email = form.get("email", "")
+    password = form.get("password", "")
+    next_path = form.get("next") or "/"
+    success, data, err = await supabase_login(email, password)
     if success and data:
         # Create session
-        session_id = str(uuid.uuid4())
-        SESSIONS[session_id] = {
-            "email": email,
-            "access_token": data.get("access_token"),
-            "refresh_token": data.get("refresh_token"),
-        }
+        session = SESSION_SERIALIZER.dumps({"email": email})
         response = RedirectResponse(url=next_path, status_code=302)
-        response.set_cookie("session_id", session_id, httponly=True)
+        response.set_cookie(
+            SESSION_COOKIE, session, max_age=SESSION_MAX_AGE, httponly=True
+        )
         return response
     error = err or "Invalid credentials."
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "login.html",
         {
-            "request": request,
-            "page_tree": page_tree,
-            "user": user,
+            **ctx,
             "message": None,
             "error": error,
             "next": next_path,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.get("/logout")
 async def logout(request: Request):
-    """Log the current user out by clearing their session."""
-    session_id = request.cookies.get("session_id")
-    if session_id and session_id in SESSIONS:
-        SESSIONS.pop(session_id, None)
+    """Log the current user out by clearing their session cookie."""
     response = RedirectResponse(url="/login", status_code=302)
-    response.delete_cookie("session_id")
+    response.delete_cookie(SESSION_COOKIE)
     return response
 
 
@@ -612,23 +860,26 @@ def call_ai_model(model: Optional[str], prompt: str) -> str:
     return f"[Model: {chosen}] You said: {prompt}"
 
 
-CHAT_HISTORY: List[Dict[str, str]] = []
+# Only the most recent messages are kept so memory use and the cost of
+# rendering the chat page stay bounded however long the server runs.
+CHAT_HISTORY_LIMIT = 200
+CHAT_HISTORY: Deque[Dict[str, str]] = deque(maxlen=CHAT_HISTORY_LIMIT)
 
 # Load settings at startup.  Settings include the default AI model.
 def load_settings() -> Dict[str, str]:
     if SETTINGS_FILE.exists():
         try:
-            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
+            with open(SETTINGS_FILE, "rb") as f:
+                return orjson.loads(f.read())
+        except orjson.JSONDecodeError:
             pass
     # Default settings if file missing or corrupted
     return {"model": "Gemini", "theme": "light"}
 
 
 def save_settings(settings: Dict[str, str]) -> None:
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, indent=2, ensure_ascii=False)
+    with open(SETTINGS_FILE, "wb") as f:
+        f.write(orjson.dumps(settings, option=orjson.OPT_INDENT_2))
 
 
 SETTINGS = load_settings()
@@ -642,16 +893,40 @@ SELECTED_THEME = SETTINGS.get("theme", "light")
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
 
-# In‑memory session store.  When a user logs in a session identifier is
-# generated and stored here along with their Supabase tokens and email.  In a
-# production environment you would use a more robust session backend.
-SESSIONS: Dict[str, Dict[str, str]] = {}
+# Shared HTTP client for Supabase calls.  Requests are awaited so the event
+# loop keeps serving other clients while waiting on the network, and the
+# underlying connection pool is reused across logins and sign‑ups.
+_HTTP = httpx.AsyncClient(timeout=10)
+
+
+@app.on_event("shutdown")
+async def close_http_client() -> None:
+    await _HTTP.aclose()
+
+
+# Sessions are stateless: on login the user’s email is signed and timestamped
+# with SESSION_SECRET and stored in the session cookie itself, so no
+# server‑side store is needed.  Supabase tokens are deliberately not kept in
+# the cookie, and sessions expire after SESSION_MAX_AGE seconds.  Every worker
+# must share the same SESSION_SECRET to validate each other’s cookies; if it
+# is unset a random per‑process secret is generated, which only works for a
+# single worker and logs everyone out on restart.
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = 7 * 24 * 60 * 60
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+if not SESSION_SECRET:
+    logging.getLogger(__name__).warning(
+        "SESSION_SECRET is not set; generated a random secret.  Sessions will "
+        "not survive a restart or be shared between workers."
+    )
+    SESSION_SECRET = secrets.token_urlsafe(32)
+SESSION_SERIALIZER = URLSafeTimedSerializer(SESSION_SECRET, salt="session")
 
 # ---------------------------------------------------------------------------
 # Supabase authentication helpers
 # ---------------------------------------------------------------------------
 
-def supabase_signup(email: str, password: str) -> tuple[bool, Optional[str]]:
+async def supabase_signup(email: str, password: str) -> tuple[bool, Optional[str]]:
     """Attempt to sign up a new user in Supabase.  Returns (success, error).
 
     On success the user must confirm their email if the Supabase project
@@ -663,7 +938,7 @@ def supabase_signup(email: str, password: str) -> tuple[bool, Optional[str]]:
     headers = {"apikey": SUPABASE_KEY, "Content-Type": "application/json"}
     payload = {"email": email, "password": password}
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
+        resp = await _HTTP.post(url, json=payload, headers=headers)
         if resp.status_code >= 400:
             return False, resp.text
         return True, None
@@ -671,7 +946,7 @@ def supabase_signup(email: str, password: str) -> tuple[bool, Optional[str]]:
         return False, str(exc)
 
 
-def supabase_login(email: str, password: str) -> tuple[bool, Optional[dict], Optional[str]]:
+async def supabase_login(email: str, password: str) -> tuple[bool, Optional[dict], Optional[str]]:
     """Authenticate a user with Supabase using the password grant.
 
     Returns (success, data, error).  On success data contains the token
@@ -683,7 +958,7 @@ def supabase_login(email: str, password: str) -> tuple[bool, Optional[dict], Opt
     headers = {"apikey": SUPABASE_KEY, "Content-Type": "application/json"}
     payload = {"email": email, "password": password}
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
+        resp = await _HTTP.post(url, json=payload, headers=headers)
         if resp.status_code >= 400:
             return False, None, resp.text
         return True, resp.json(), None
@@ -692,11 +967,15 @@ def supabase_login(email: str, password: str) -> tuple[bool, Optional[dict], Opt
 
 
 def get_current_user(request: Request) -> Optional[dict]:
-    """Retrieve the current logged‑in user from the session cookie."""
-    session_id = request.cookies.get("session_id")
-    if session_id and session_id in SESSIONS:
-        return SESSIONS[session_id]
-    return None
+    """Retrieve the current logged‑in user from the signed session cookie.
+    Missing, tampered or expired cookies yield None."""
+    session = request.cookies.get(SESSION_COOKIE)
+    if not session:
+        return None
+    try:
+        return SESSION_SERIALIZER.loads(session, max_age=SESSION_MAX_AGE)
+    except BadSignature:
+        return None
 
 
 def get_current_theme() -> str:
@@ -705,48 +984,41 @@ def get_current_theme() -> str:
     return SELECTED_THEME
 
 
-def require_login(request: Request):
+def require_login(request: Request, user: Optional[dict]):
     """If the user is not logged in, redirect to the login page with a `next`
     parameter pointing back to the current path.  If logged in, return None.
+    `user` is the result of `get_current_user`, passed in so handlers that
+    already have it from `common_context` do not decode the cookie again.
     """
-    user = get_current_user(request)
     if not user:
         return RedirectResponse(url=f"/login?next={request.url.path}", status_code=302)
     return None
 
 
 @app.get("/ai")
-async def ai_chat(request: Request):
+async def ai_chat(request: Request, ctx: dict = Depends(common_context)):
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, ctx["user"])):
         return resp
-    page_tree = get_page_tree()
-    user = get_current_user(request)
     return templates.TemplateResponse(
         "ai.html",
         {
-            "request": request,
-            "page_tree": page_tree,
+            **ctx,
             "history": CHAT_HISTORY,
             "selected_model": SELECTED_MODEL,
-            "user": user,
-            "theme": SELECTED_THEME,
         },
     )
 
 
 @app.post("/ai")
 async def ai_chat_post(request: Request):
-    """Handle AI chat submissions (login required).  Parse form data manually."""
+    """Handle AI chat submissions (login required)."""
     # Require login
-    if (resp := require_login(request)):
+    if (resp := require_login(request, get_current_user(request))):
         return resp
-    import urllib.parse
-
-    body = await request.body()
-    form = urllib.parse.parse_qs(body.decode())
-    model = form.get("model", [""])[0]
-    message = form.get("message", [""])[0]
+    form = await get_form(request)
+    model = form.get("model", "")
+    message = form.get("message", "")
     response_text = call_ai_model(model, message)
     CHAT_HISTORY.append({"role": "user", "text": message})
     CHAT_HISTORY.append({"role": "assistant", "text": response_text})
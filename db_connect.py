@@ -4,10 +4,10 @@ Database connection test script.
 This module provides a simple function to test connectivity to a PostgreSQL
 database using credentials defined in a `.env` file. It uses the
 ``python‑dotenv`` package to load environment variables and the
-``psycopg2`` library to create a connection. Running this script from the
-command line will attempt to connect to the database, execute a simple
-``SELECT NOW()`` query, print the current time returned by the server and
-close the connection.
+``psycopg2`` library to maintain a small shared connection pool. Running this
+script from the command line will borrow a connection from the pool, execute
+a simple ``SELECT NOW()`` query, print the current time returned by the
+server and return the connection to the pool.
 
 Environment variables required in the `.env` file include:
 
@@ -37,58 +37,69 @@ handle exceptions and sensitive data carefully.
 """
 
 import os
+from typing import Optional
 
-import psycopg2
 from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+
+# Load environment variables from .env once at import time
+load_dotenv()
+
+# Shared connection pool, created on first use so that importing this module
+# does not require a reachable database.  Reusing pooled connections avoids a
+# fresh TCP and TLS handshake for every query.
+_POOL: Optional[ThreadedConnectionPool] = None
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Return the module‑wide connection pool, creating it if necessary."""
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadedConnectionPool(
+            minconn=1,
+            maxconn=8,
+            user=os.getenv("user"),
+            password=os.getenv("password"),
+            host=os.getenv("host"),
+            port=os.getenv("port"),
+            dbname=os.getenv("dbname"),
+        )
+    return _POOL
 
 
 def test_database_connection() -> None:
     """Test a connection to the PostgreSQL database and print the current time.
 
-    Loads configuration from a `.env` file, attempts to connect to the
-    database using the provided credentials, and executes a simple query
-    (``SELECT NOW()``) to retrieve the current server time. Prints
-    diagnostic messages about the connection status and gracefully
-    closes the connection.
+    Borrows a connection from the shared pool, configured from the `.env`
+    file, and executes a simple query (``SELECT NOW()``) to retrieve the
+    current server time. Prints diagnostic messages about the connection
+    status and returns the connection to the pool afterwards.
     """
-    # Load environment variables from .env
-    load_dotenv()
-
-    # Fetch variables
-    user = os.getenv("user")
-    password = os.getenv("password")
-    host = os.getenv("host")
-    port = os.getenv("port")
-    dbname = os.getenv("dbname")
-
     try:
-        # Connect to the database
-        connection = psycopg2.connect(
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            dbname=dbname,
-        )
+        pool = get_pool()
+        connection = pool.getconn()
         print("Connection successful!")
 
-        # Create a cursor to execute SQL queries
-        cursor = connection.cursor()
-
-        # Example query
-        cursor.execute("SELECT NOW();")
-        result = cursor.fetchone()
-        print("Current Time:", result)
-
-        # Close the cursor and connection
-        cursor.close()
-        connection.close()
-        print("Connection closed.")
+        try:
+            # Create a cursor to execute SQL queries
+            with connection.cursor() as cursor:
+                # Example query
+                cursor.execute("SELECT NOW();")
+                result = cursor.fetchone()
+                print("Current Time:", result)
+        finally:
+            # Hand the connection back for reuse
+            pool.putconn(connection)
+            print("Connection returned to pool.")
 
     except Exception as exc:
         print(f"Failed to connect: {exc}")
 
 
 if __name__ == "__main__":
-    # Run the test when executed as a script
-    test_database_connection()
\ No newline at end of file
+    # Run the test when executed as a script, then close pooled connections
+    try:
+        test_database_connection()
+    finally:
+        if _POOL is not None:
+            _POOL.closeall()